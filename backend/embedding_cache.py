@@ -0,0 +1,105 @@
+"""
+エンベディングの永続キャッシュ
+sqlite3ベースの組み込みKVストアで、ウォーム済みエンベディングを
+コンテナ再起動・デプロイをまたいで再利用する
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class PersistentEmbeddingCache:
+    """sqlite3を使ったエンベディングのディスク永続キャッシュ"""
+
+    # デフォルトTTL: 30日
+    DEFAULT_TTL_SECONDS = 30 * 86400
+
+    def __init__(self, path: str, ttl_seconds: int = DEFAULT_TTL_SECONDS):
+        """
+        PersistentEmbeddingCacheを初期化
+
+        Args:
+            path: キャッシュデータベースのファイルパス
+            ttl_seconds: エントリの有効期限（秒）
+        """
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+
+        # 推論スレッドプールと起動時ウォームアップの両方から使うため直列化
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key BLOB PRIMARY KEY, "
+            "vector BLOB NOT NULL, "
+            "created_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: bytes) -> Optional[np.ndarray]:
+        """
+        キャッシュからベクトルを取得
+
+        Args:
+            key: コンテンツアドレスキー（ハッシュダイジェスト）
+
+        Returns:
+            float32のベクトル。未登録または期限切れの場合はNone
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT vector, created_at FROM embeddings WHERE key = ?", (key,)
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        vector_blob, created_at = row
+        if time.time() - created_at > self.ttl_seconds:
+            self.delete(key)
+            return None
+
+        return np.frombuffer(vector_blob, dtype=np.float32)
+
+    def set(self, key: bytes, vector: np.ndarray) -> None:
+        """
+        ベクトルをキャッシュに保存
+
+        Args:
+            key: コンテンツアドレスキー（ハッシュダイジェスト）
+            vector: float32のベクトル
+        """
+        blob = np.asarray(vector, dtype=np.float32).tobytes()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO embeddings (key, vector, created_at) "
+                "VALUES (?, ?, ?)",
+                (key, blob, time.time())
+            )
+            self._conn.commit()
+
+    def delete(self, key: bytes) -> None:
+        """
+        キャッシュからエントリを削除
+
+        Args:
+            key: コンテンツアドレスキー（ハッシュダイジェスト）
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def close(self) -> None:
+        """データベース接続をクローズ"""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+CLAPテキストエンコーダーのONNXエクスポートスクリプト
+CPUデプロイ向けに、ビルド時にtext_branch＋射影＋L2正規化を
+ONNX形式で書き出す（サーバー側はonnxruntimeでロードする）
+"""
+
+import argparse
+import logging
+
+import torch
+import torch.nn.functional as F
+
+from vector_processor import VectorProcessor
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class TextEncoderWrapper(torch.nn.Module):
+    """text_branch・text_projection・L2正規化をまとめたエクスポート用モジュール"""
+
+    def __init__(self, clap_model):
+        """
+        TextEncoderWrapperを初期化
+
+        Args:
+            clap_model: laion_clapの内部CLAPモデル
+        """
+        super().__init__()
+        # torch.compile済みの場合は元のeagerモジュールを取り出す
+        text_branch = clap_model.text_branch
+        self.text_branch = getattr(text_branch, "_orig_mod", text_branch)
+        self.text_projection = clap_model.text_projection
+
+    def forward(self, input_ids, attention_mask):
+        """トークンIDから正規化済みエンベディングを計算"""
+        x = self.text_branch(
+            input_ids=input_ids, attention_mask=attention_mask
+        )["pooler_output"]
+        x = self.text_projection(x)
+        return F.normalize(x, dim=-1)
+
+
+def export_onnx(output_path: str) -> None:
+    """
+    CLAPテキストエンコーダーをONNX形式でエクスポート
+
+    Args:
+        output_path: 出力するONNXファイルのパス
+    """
+    logger.info("Loading CLAP model for ONNX export...")
+    processor = VectorProcessor()
+    processor.initialize_model()
+
+    wrapper = TextEncoderWrapper(processor.model.model).eval()
+
+    # ダミー入力（laion_clapの標準経路と同じトークナイズ条件）
+    tokens = processor.model.tokenize(
+        ["onnx export"],
+        padding="max_length",
+        truncation=True,
+        max_length=77,
+        return_tensors="pt"
+    )
+
+    logger.info(f"Exporting text encoder to {output_path}...")
+    torch.onnx.export(
+        wrapper,
+        (tokens["input_ids"], tokens["attention_mask"]),
+        output_path,
+        opset_version=17,
+        input_names=["input_ids", "attention_mask"],
+        output_names=["text_embedding"],
+        dynamic_axes={
+            "input_ids": {0: "batch", 1: "sequence"},
+            "attention_mask": {0: "batch", 1: "sequence"},
+            "text_embedding": {0: "batch"}
+        }
+    )
+    logger.info(f"✅ ONNX export completed: {output_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export CLAP text encoder to ONNX")
+    parser.add_argument("--output", default="clap_text.onnx", help="出力ファイルパス")
+    args = parser.parse_args()
+    export_onnx(args.output)
@@ -3,15 +3,25 @@ NiconiCommonsVecSearch Backend API
 キーワードベクトル化機能を提供するFastAPI アプリケーション
 """
 
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field, field_validator
 from typing import List, Dict, Any, Optional
+import asyncio
 import logging
+import os
+import struct
 import time
+
+import numpy as np
+import orjson
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 
-from vector_processor import get_vector_processor, VectorProcessor
+import torch
+
+from vector_processor import VectorProcessor
 
 # ログ設定
 logging.basicConfig(level=logging.INFO)
@@ -23,11 +33,29 @@ class VectorizeRequest(BaseModel):
     """ベクトル化リクエストモデル"""
     keyword: str = Field(..., min_length=1, max_length=1000, description="ベクトル化するキーワード")
 
+    @field_validator("keyword")
+    @classmethod
+    def strip_keyword(cls, v: str) -> str:
+        """前後の空白を除去し、空キーワードを拒否"""
+        v = v.strip()
+        if not v:
+            raise ValueError("Empty keyword")
+        return v
+
 
 class BatchVectorizeRequest(BaseModel):
     """バッチベクトル化リクエストモデル"""
     keywords: List[str] = Field(..., min_items=1, max_items=100, description="ベクトル化するキーワードのリスト")
 
+    @field_validator("keywords")
+    @classmethod
+    def strip_keywords(cls, v: List[str]) -> List[str]:
+        """各キーワードの前後空白を除去し、空キーワードを拒否"""
+        stripped = [keyword.strip() for keyword in v]
+        if not all(stripped):
+            raise ValueError("Empty keyword in list")
+        return stripped
+
 
 class VectorizeResponse(BaseModel):
     """ベクトル化レスポンスモデル"""
@@ -52,21 +80,124 @@ class HealthResponse(BaseModel):
     model_status: Dict[str, Any] = Field(..., description="モデルステータス")
 
 
+class MicroBatcher:
+    """同時到着した単発リクエストをまとめてバッチ推論するマイクロバッチャー"""
+
+    def __init__(self, processor: VectorProcessor, executor: ThreadPoolExecutor,
+                 window_seconds: float = 0.005, max_batch_size: int = 32):
+        """
+        MicroBatcherを初期化
+
+        Args:
+            processor: ベクトル化プロセッサー
+            executor: 推論を実行するスレッドプール
+            window_seconds: リクエストをまとめる時間窓（秒）
+            max_batch_size: 1バッチの最大件数
+        """
+        self.processor = processor
+        self.executor = executor
+        self.window_seconds = window_seconds
+        self.max_batch_size = max_batch_size
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """バックグラウンドのバッチ処理タスクを起動"""
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """バックグラウンドタスクを停止"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def submit(self, keyword: str) -> Dict[str, Any]:
+        """
+        キーワードをバッチ処理キューに投入し、結果を待つ
+
+        Args:
+            keyword: ベクトル化するキーワード
+
+        Returns:
+            ベクトル化結果の辞書
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((keyword, future))
+        return await future
+
+    async def _run(self) -> None:
+        """キューからリクエストを収集してバッチ単位で推論を実行"""
+        loop = asyncio.get_running_loop()
+        while True:
+            # 最初の1件を待ち、時間窓内に到着した分を追加で収集
+            items = [await self._queue.get()]
+            while len(items) < self.max_batch_size:
+                try:
+                    items.append(await asyncio.wait_for(
+                        self._queue.get(), timeout=self.window_seconds
+                    ))
+                except asyncio.TimeoutError:
+                    break
+
+            keywords = [keyword for keyword, _ in items]
+            try:
+                results = await loop.run_in_executor(
+                    self.executor, self.processor.vectorize_batch, keywords
+                )
+                # 結果を待機中の各コルーチンへ分配
+                for (_, future), result in zip(items, results):
+                    if not future.done():
+                        future.set_result(result)
+            except Exception as e:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+
+
 # アプリケーション初期化
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """アプリケーションライフサイクル管理"""
     # 起動時処理
     logger.info("🚀 Starting NiconiCommonsVecSearch Backend API...")
-    
+
+    # PyTorchのグローバル設定
+    # スレッド数を抑えてコンテナ内でのCPU過剰並列（推論スレッドプール
+    # との競合）を防ぐ。勾配モードはスレッドローカルなため、推論側の
+    # 無効化は_encode_batch内のno_gradが担う（ここでの設定は
+    # イベントループスレッドのみに効く）
+    torch.set_grad_enabled(False)
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // 2))
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # 既に並列処理が開始された後は変更できない
+        pass
+
+    # プロセッサーはプロセスごとに1つだけapp.stateに保持する
+    # （uvicornの--workers Nはワーカーごとにモデルを多重ロードするため使わず、
+    # 水平スケールはコンテナのレプリカ数で行う）
+    app.state.processor = VectorProcessor()
+
+    # 推論専用のスレッドプール
+    # max_workers=1: モデルはスレッドセーフでなく、PyTorch自体が内部で並列化するため
+    app.state.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="clap-inference")
+
+    # 単発リクエストをまとめるマイクロバッチャーを起動
+    app.state.batcher = MicroBatcher(app.state.processor, app.state.executor)
+    app.state.batcher.start()
+
     # CLAPモデルの事前初期化でコールドスタート軽減
     try:
         logger.info("🔥 Pre-warming CLAP model to reduce cold start latency...")
         start_time = time.time()
         
-        vector_processor = get_vector_processor()
         # 軽量なテストでモデルウォームアップ
-        test_result = vector_processor.vectorize_keyword("warmup test")
+        test_result = app.state.processor.vectorize_keyword("warmup test")
         
         warmup_time = time.time() - start_time
         logger.info(f"✅ Model pre-warmed successfully in {warmup_time:.2f}s")
@@ -77,9 +208,11 @@ async def lifespan(app: FastAPI):
         logger.warning("   First API request will experience cold start delay")
     
     yield
-    
+
     # 終了時処理
     logger.info("🛑 Shutting down NiconiCommonsVecSearch Backend API...")
+    await app.state.batcher.stop()
+    app.state.executor.shutdown(wait=True)
 
 
 # FastAPIアプリケーション作成
@@ -87,7 +220,9 @@ app = FastAPI(
     title="NiconiCommonsVecSearch API",
     description="ニコニ・コモンズ楽曲検索のためのキーワードベクトル化API",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    # orjsonのNumPyネイティブ対応でレスポンス直列化を高速化
+    default_response_class=ORJSONResponse
 )
 
 # CORSミドルウェア設定
@@ -110,12 +245,50 @@ async def root():
     }
 
 
+def get_processor(request: Request) -> VectorProcessor:
+    """
+    app.stateからVectorProcessorを取得する依存関係
+
+    Args:
+        request: FastAPIリクエスト
+
+    Returns:
+        VectorProcessorインスタンス
+    """
+    return request.app.state.processor
+
+
+def get_batcher(request: Request) -> MicroBatcher:
+    """
+    app.stateからMicroBatcherを取得する依存関係
+
+    Args:
+        request: FastAPIリクエスト
+
+    Returns:
+        MicroBatcherインスタンス
+    """
+    return request.app.state.batcher
+
+
+def get_executor(request: Request) -> ThreadPoolExecutor:
+    """
+    app.stateから推論用スレッドプールを取得する依存関係
+
+    Args:
+        request: FastAPIリクエスト
+
+    Returns:
+        ThreadPoolExecutorインスタンス
+    """
+    return request.app.state.executor
+
+
 @app.get("/health", response_model=HealthResponse)
-async def health_check():
+async def health_check(processor: VectorProcessor = Depends(get_processor)):
     """ヘルスチェックエンドポイント"""
     try:
-        vector_processor = get_vector_processor()
-        model_info = vector_processor.get_model_info()
+        model_info = processor.get_model_info()
         
         return HealthResponse(
             status="healthy",
@@ -128,12 +301,16 @@ async def health_check():
 
 
 @app.post("/api/vectorize", response_model=VectorizeResponse)
-async def vectorize_keyword(request: VectorizeRequest):
+async def vectorize_keyword(
+    request: VectorizeRequest,
+    batcher: MicroBatcher = Depends(get_batcher)
+):
     """
     キーワードをベクトル化するエンドポイント
     
     Args:
         request: ベクトル化リクエスト
+        batcher: マイクロバッチャー
         
     Returns:
         ベクトル化結果
@@ -143,22 +320,24 @@ async def vectorize_keyword(request: VectorizeRequest):
     try:
         logger.info(f"Received vectorization request for keyword: {request.keyword}")
         
-        # ベクトル化処理
-        vector_processor = get_vector_processor()
-        result = vector_processor.vectorize_keyword(request.keyword)
-        
+        # ベクトル化処理（マイクロバッチャー経由で同時リクエストをまとめる）
+        result = await batcher.submit(request.keyword)
+
         processing_time = time.time() - start_time
-        
-        response = VectorizeResponse(
-            keyword=result["keyword"],
-            vector=result["vector"],
-            dimension=result["dimension"],
-            processing_time=processing_time,
-            model_info=result["model_info"]
-        )
-        
+
+        # Pydanticの再検証を通すとndarrayが要素ごとにPython floatへ
+        # 変換されてしまうため、ORJSONResponseを直接構築して
+        # orjsonのNumPyネイティブ経路（OPT_SERIALIZE_NUMPY）で直列化する
+        response = {
+            "keyword": result["keyword"],
+            "vector": result["vector"],
+            "dimension": result["dimension"],
+            "processing_time": processing_time,
+            "model_info": result["model_info"]
+        }
+
         logger.info(f"Successfully vectorized keyword in {processing_time:.3f}s")
-        return response
+        return ORJSONResponse(response)
         
     except ValueError as e:
         logger.error(f"Invalid input: {e}")
@@ -168,13 +347,87 @@ async def vectorize_keyword(request: VectorizeRequest):
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
+@app.post("/api/vectorize/raw")
+async def vectorize_keyword_raw(
+    request: VectorizeRequest,
+    batcher: MicroBatcher = Depends(get_batcher)
+):
+    """
+    キーワードをベクトル化し、FP16バイト列で返すエンドポイント
+
+    レスポンスボディはリトルエンディアンFP16のdim * 2バイト。
+    クライアント側は np.frombuffer(body, dtype=np.float16) でデコードする。
+    JSON配列（FP32の10進表記）に比べてペイロードが約7分の1になる。
+
+    Args:
+        request: ベクトル化リクエスト
+        batcher: マイクロバッチャー
+
+    Returns:
+        application/octet-streamのレスポンス
+    """
+    try:
+        result = await batcher.submit(request.keyword)
+        payload = np.asarray(result["vector"], dtype=np.float16).tobytes()
+        return Response(content=payload, media_type="application/octet-stream")
+
+    except ValueError as e:
+        logger.error(f"Invalid input: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Vectorization failed: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
+@app.post("/api/vectorize/batch/raw")
+async def vectorize_keywords_batch_raw(
+    request: BatchVectorizeRequest,
+    processor: VectorProcessor = Depends(get_processor),
+    executor: ThreadPoolExecutor = Depends(get_executor)
+):
+    """
+    複数キーワードを一括ベクトル化し、FP16バイト列で返すエンドポイント
+
+    レスポンスボディは8バイトのヘッダー（uint32リトルエンディアンの
+    n, dim）に続いてn * dim * 2バイトのFP16行列。クライアント側は
+    np.frombuffer(body[8:], dtype=np.float16).reshape(n, dim) でデコードする。
+
+    Args:
+        request: バッチベクトル化リクエスト
+        processor: ベクトル化プロセッサー
+
+    Returns:
+        application/octet-streamのレスポンス
+    """
+    try:
+        results = await asyncio.get_running_loop().run_in_executor(
+            executor, processor.vectorize_batch, request.keywords
+        )
+
+        matrix = np.stack([result["vector"] for result in results]).astype(np.float16)
+        header = struct.pack("<II", matrix.shape[0], matrix.shape[1])
+        return Response(content=header + matrix.tobytes(), media_type="application/octet-stream")
+
+    except ValueError as e:
+        logger.error(f"Invalid input: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Batch vectorization failed: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
 @app.post("/api/vectorize/batch", response_model=BatchVectorizeResponse)
-async def vectorize_keywords_batch(request: BatchVectorizeRequest):
+async def vectorize_keywords_batch(
+    request: BatchVectorizeRequest,
+    processor: VectorProcessor = Depends(get_processor),
+    executor: ThreadPoolExecutor = Depends(get_executor)
+):
     """
     複数のキーワードを一括ベクトル化するエンドポイント
     
     Args:
         request: バッチベクトル化リクエスト
+        processor: ベクトル化プロセッサー
         
     Returns:
         バッチベクトル化結果
@@ -184,31 +437,32 @@ async def vectorize_keywords_batch(request: BatchVectorizeRequest):
     try:
         logger.info(f"Received batch vectorization request for {len(request.keywords)} keywords")
         
-        # バッチベクトル化処理
-        vector_processor = get_vector_processor()
-        results = vector_processor.vectorize_batch(request.keywords)
-        
-        processing_time = time.time() - start_time
-        
-        # レスポンス変換
-        vectorize_responses = []
-        for result in results:
-            vectorize_responses.append(VectorizeResponse(
-                keyword=result["keyword"],
-                vector=result["vector"],
-                dimension=result["dimension"],
-                processing_time=processing_time / len(results),  # 平均処理時間
-                model_info=result["model_info"]
-            ))
-        
-        response = BatchVectorizeResponse(
-            results=vectorize_responses,
-            total_count=len(vectorize_responses),
-            processing_time=processing_time
+        # バッチベクトル化処理（ブロッキングな推論はスレッドプールへオフロード）
+        results = await asyncio.get_running_loop().run_in_executor(
+            executor, processor.vectorize_batch, request.keywords
         )
-        
+
+        processing_time = time.time() - start_time
+
+        # レスポンス変換（単一エンドポイントと同じ理由でPydanticの
+        # 再検証を通さず、ndarrayのままorjsonに渡す）
+        response = {
+            "results": [
+                {
+                    "keyword": result["keyword"],
+                    "vector": result["vector"],
+                    "dimension": result["dimension"],
+                    "processing_time": processing_time / len(results),  # 平均処理時間
+                    "model_info": result["model_info"]
+                }
+                for result in results
+            ],
+            "total_count": len(results),
+            "processing_time": processing_time
+        }
+
         logger.info(f"Successfully vectorized {len(results)} keywords in {processing_time:.3f}s")
-        return response
+        return ORJSONResponse(response)
         
     except ValueError as e:
         logger.error(f"Invalid input: {e}")
@@ -218,8 +472,46 @@ async def vectorize_keywords_batch(request: BatchVectorizeRequest):
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
+# ストリーミング時に一度に処理するサブバッチの件数
+STREAM_CHUNK_SIZE = 32
+
+
+@app.post("/api/vectorize/batch/stream")
+async def vectorize_keywords_batch_stream(
+    request: BatchVectorizeRequest,
+    processor: VectorProcessor = Depends(get_processor),
+    executor: ThreadPoolExecutor = Depends(get_executor)
+):
+    """
+    バッチ結果をNDJSONでストリーミングするエンドポイント
+
+    キーワードをサブバッチ単位で処理し、完了したものから1行1件の
+    JSONとして順次送出する。全件をメモリに貯めないためピークRSSが
+    バッチサイズに比例せず、クライアントは全件完了を待たずに
+    先頭から読み始められる。
+
+    Args:
+        request: バッチベクトル化リクエスト
+        processor: ベクトル化プロセッサー
+
+    Returns:
+        application/x-ndjsonのストリーミングレスポンス
+    """
+    async def generate():
+        loop = asyncio.get_running_loop()
+        for start in range(0, len(request.keywords), STREAM_CHUNK_SIZE):
+            chunk = request.keywords[start:start + STREAM_CHUNK_SIZE]
+            results = await loop.run_in_executor(
+                executor, processor.vectorize_batch, chunk
+            )
+            for result in results:
+                yield orjson.dumps(result, option=orjson.OPT_SERIALIZE_NUMPY) + b"\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
 @app.get("/api/model/info", response_model=Dict[str, Any])
-async def get_model_info():
+async def get_model_info(processor: VectorProcessor = Depends(get_processor)):
     """
     モデル情報を取得するエンドポイント
     
@@ -227,9 +519,7 @@ async def get_model_info():
         モデル情報
     """
     try:
-        vector_processor = get_vector_processor()
-        model_info = vector_processor.get_model_info()
-        return model_info
+        return processor.get_model_info()
     except Exception as e:
         logger.error(f"Failed to get model info: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
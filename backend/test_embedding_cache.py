@@ -0,0 +1,66 @@
+"""
+embedding_cache.py のテストファイル
+"""
+
+import numpy as np
+
+from embedding_cache import PersistentEmbeddingCache
+
+
+class TestPersistentEmbeddingCache:
+    """PersistentEmbeddingCacheクラスのテスト"""
+
+    def test_set_get_roundtrip(self, tmp_path):
+        """保存と取得のラウンドトリップのテスト"""
+        cache = PersistentEmbeddingCache(str(tmp_path / "cache.db"))
+
+        vector = np.random.rand(512).astype(np.float32)
+        cache.set(b"key1", vector)
+
+        restored = cache.get(b"key1")
+        assert restored is not None
+        assert np.array_equal(restored, vector)
+        cache.close()
+
+    def test_get_missing_key(self, tmp_path):
+        """未登録キーの取得のテスト"""
+        cache = PersistentEmbeddingCache(str(tmp_path / "cache.db"))
+
+        assert cache.get(b"missing") is None
+        cache.close()
+
+    def test_persistence_across_instances(self, tmp_path):
+        """インスタンス再生成後の永続性のテスト（再起動の再現）"""
+        path = str(tmp_path / "cache.db")
+        vector = np.random.rand(512).astype(np.float32)
+
+        cache1 = PersistentEmbeddingCache(path)
+        cache1.set(b"key1", vector)
+        cache1.close()
+
+        # 再起動を模して別インスタンスで開き直す
+        cache2 = PersistentEmbeddingCache(path)
+        restored = cache2.get(b"key1")
+        assert restored is not None
+        assert np.array_equal(restored, vector)
+        cache2.close()
+
+    def test_ttl_expiry(self, tmp_path):
+        """TTL期限切れエントリが返らないテスト"""
+        cache = PersistentEmbeddingCache(str(tmp_path / "cache.db"), ttl_seconds=0)
+
+        cache.set(b"key1", np.random.rand(512).astype(np.float32))
+
+        # ttl_seconds=0のため即座に期限切れ
+        assert cache.get(b"key1") is None
+        cache.close()
+
+    def test_delete(self, tmp_path):
+        """エントリ削除のテスト"""
+        cache = PersistentEmbeddingCache(str(tmp_path / "cache.db"))
+
+        cache.set(b"key1", np.random.rand(512).astype(np.float32))
+        cache.delete(b"key1")
+
+        assert cache.get(b"key1") is None
+        cache.close()
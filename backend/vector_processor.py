@@ -3,41 +3,204 @@
 CLAPモデルを使用してテキストキーワードをベクトル表現に変換する
 """
 
+import contextlib
+import hashlib
 import logging
+import os
 from typing import List, Optional, Dict, Any
 import numpy as np
 import torch
-import laion_clap
+from cachetools import LRUCache
 from pathlib import Path
 
-# ログ設定
-logging.basicConfig(level=logging.INFO)
+from embedding_cache import PersistentEmbeddingCache
+
+# laion_clapはインポートに数百msかかるため、initialize_modelで遅延ロードする
+# （モデルを使わないプロセスやテストの起動を速くする）
+laion_clap = None
+
+# ログ設定はエントリポイント（main.py / warmup.py）で行う
 logger = logging.getLogger(__name__)
 
 
 class VectorProcessor:
     """CLAPを使用したキーワードベクトル化プロセッサー"""
-    
-    def __init__(self, model_name: str = "630k-audioset-best.pt", enable_fusion: bool = False):
+
+    # エンベディングキャッシュの最大エントリ数（512次元float32で約100MB相当）
+    CACHE_MAXSIZE = 50_000
+
+    # バッチパディング用のセンチネルテキスト（出力はスライスで除外される）
+    PAD_TEXT = "<pad>"
+
+    # エンベディングの次元数とピン止めバッファが受けられる最大バッチサイズ
+    EMBED_DIM = 512
+    MAX_PINNED_BATCH = 128
+
+    # CPU推論用にエクスポート済みONNXテキストエンコーダーのデフォルトパス
+    ONNX_MODEL_PATH = "clap_text.onnx"
+
+    # 同一サブバッチとみなすトークン長の差の上限
+    LENGTH_BUCKET_WIDTH = 4
+
+    def __init__(self, model_name: str = "630k-audioset-best.pt", enable_fusion: bool = False,
+                 cache_path: Optional[str] = None):
         """
         VectorProcessorを初期化
-        
+
         Args:
             model_name: CLAPモデル名
             enable_fusion: fusion機能の有効化
+            cache_path: エンベディング永続キャッシュのファイルパス
+                        （未指定時は環境変数EMBEDDING_CACHE_PATHを参照）
         """
         self.model_name = model_name
         self.enable_fusion = enable_fusion
-        self.model: Optional[laion_clap.CLAP_Module] = None
+        self.model: Optional["laion_clap.CLAP_Module"] = None
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        # 同一キーワードの再エンコードを回避するコンテンツアドレス型キャッシュ
+        self._cache: LRUCache = LRUCache(maxsize=self.CACHE_MAXSIZE)
+
+        # ディスク永続キャッシュ（再起動後もウォーム済みエンベディングを再利用）
+        cache_path = cache_path or os.environ.get("EMBEDDING_CACHE_PATH")
+        self._disk_cache: Optional[PersistentEmbeddingCache] = None
+        if cache_path:
+            try:
+                self._disk_cache = PersistentEmbeddingCache(cache_path)
+                logger.info(f"Persistent embedding cache enabled: {cache_path}")
+            except Exception as e:
+                logger.warning(f"⚠️  Failed to open persistent embedding cache: {e}")
+        # トークナイズ結果のキャッシュ（テキスト -> input_ids / attention_mask）
+        self._token_cache: LRUCache = LRUCache(maxsize=self.CACHE_MAXSIZE)
+        self._warned_direct_encode = False
+        # D2H転送用のピン止めバッファと専用コピーストリーム（GPUのみ）
+        self._pinned = None
+        self._copy_stream = None
+        # ONNX Runtimeセッション（CPU環境でエクスポート済みモデルがある場合のみ）
+        self._ort_session = None
         logger.info(f"Using device: {self.device}")
-        
+
+    def _cache_key(self, text: str) -> bytes:
+        """
+        キャッシュキーを生成（モデル設定＋テキストのハッシュ）
+
+        Args:
+            text: 前処理済みテキスト
+
+        Returns:
+            キャッシュキーのダイジェスト
+        """
+        h = hashlib.sha256()
+        h.update(self.model_name.encode("utf-8"))
+        h.update(b"\x00")
+        h.update(b"1" if self.enable_fusion else b"0")
+        h.update(b"\x00")
+        h.update(text.encode("utf-8"))
+        return h.digest()
+
+    def _cache_get(self, key: bytes) -> Optional[np.ndarray]:
+        """
+        メモリ・ディスクの順にキャッシュを検索
+
+        Args:
+            key: キャッシュキーのダイジェスト
+
+        Returns:
+            キャッシュ済みベクトル。未登録の場合はNone
+        """
+        vector = self._cache.get(key)
+        if vector is None and self._disk_cache is not None:
+            vector = self._disk_cache.get(key)
+            if vector is not None:
+                # ディスクヒットはメモリ側にも昇格
+                self._cache[key] = vector
+        return vector
+
+    def _cache_put(self, key: bytes, vector: np.ndarray) -> None:
+        """
+        ベクトルをメモリ・ディスク両方のキャッシュに保存
+
+        Args:
+            key: キャッシュキーのダイジェスト
+            vector: float32のベクトル
+        """
+        self._cache[key] = vector
+        if self._disk_cache is not None:
+            try:
+                self._disk_cache.set(key, vector)
+            except Exception as e:
+                logger.warning(f"⚠️  Failed to write persistent embedding cache: {e}")
+
+    def _token_length(self, text: str) -> int:
+        """
+        テキストのトークン長を取得
+
+        Args:
+            text: 前処理済みテキスト
+
+        Returns:
+            トークン数（トークナイザーが使えない環境では単語数で近似）
+        """
+        try:
+            return int(self._tokenize_cached(text)["attention_mask"].sum())
+        except Exception:
+            return len(text.split())
+
+    def _split_by_length(self, texts: List[str]) -> List[List[int]]:
+        """
+        トークン長の近いテキスト同士のサブバッチに分割
+
+        _build_token_batchはバッチ内最長の実トークン長までしか
+        スライスできないため、トークン長でソートして差が
+        LENGTH_BUCKET_WIDTH未満のものを同一サブバッチにまとめ、
+        長さの近い入力同士でスライス幅を最小化する。
+
+        Args:
+            texts: 前処理済みテキストのリスト
+
+        Returns:
+            texts内インデックスのサブバッチのリスト
+        """
+        lengths = [self._token_length(text) for text in texts]
+        order = sorted(range(len(texts)), key=lambda i: lengths[i])
+
+        groups: List[List[int]] = []
+        for i in order:
+            if groups and lengths[i] - lengths[groups[-1][0]] < self.LENGTH_BUCKET_WIDTH:
+                groups[-1].append(i)
+            else:
+                groups.append([i])
+        return groups
+
+    @staticmethod
+    def _bucket_size(n: int) -> int:
+        """
+        バッチサイズを切り上げる2のべき乗バケットを返す
+
+        バッチサイズを少数の固定形状 {1, 2, 4, 8, ...} に揃えることで、
+        コンパイル済みグラフの再利用率を高め再コンパイルを防ぐ。
+
+        Args:
+            n: 実際のバッチサイズ
+
+        Returns:
+            n以上で最小の2のべき乗
+        """
+        bucket = 1
+        while bucket < n:
+            bucket *= 2
+        return bucket
+
     def initialize_model(self) -> None:
         """CLAPモデルを初期化・ロード"""
         try:
             logger.info("Initializing CLAP model...")
             logger.info("⚠️  First-time model download may take 1-2 minutes...")
-            
+
+            # 遅延インポート（初回のみ）
+            global laion_clap
+            if laion_clap is None:
+                import laion_clap
+
             # CLAPモデルの初期化
             self.model = laion_clap.CLAP_Module(
                 enable_fusion=self.enable_fusion,
@@ -48,17 +211,245 @@ class VectorProcessor:
             logger.info("Loading pre-trained checkpoint...")
             self.model.load_ckpt()  # デフォルトのcheckpointをロード
             self.model.eval()  # 評価モードに設定
-            
+
+            # GPUではテキストエンコーダーをFP16化
+            # （下流のコサイン類似度はFP16の丸め誤差に影響されない）
+            if self.device.type == "cuda":
+                self.model.model.text_branch.half()
+
+                # D2H転送用のピン止めバッファと専用コピーストリームを確保
+                self._pinned = torch.empty(
+                    self.MAX_PINNED_BATCH, self.EMBED_DIM,
+                    dtype=torch.float32, pin_memory=True
+                )
+                self._copy_stream = torch.cuda.Stream()
+
+            # CPU環境ではエクスポート済みONNXエンコーダーがあればロード
+            if self.device.type == "cpu":
+                self._load_onnx_session()
+
+            # テキストエンコーダーをコンパイルしてディスパッチオーバーヘッドを削減
+            self._compile_text_branch()
+
             logger.info("✅ CLAP model initialized successfully")
             
         except Exception as e:
             logger.error(f"❌ Failed to initialize CLAP model: {e}")
             raise
-    
+
+    def _compile_text_branch(self) -> None:
+        """
+        テキストエンコーダーをtorch.compileでコンパイル
+
+        小バッチ推論で支配的なPython/PyTorchディスパッチオーバーヘッドを
+        削減する。未対応環境ではeagerモードのまま動作する。
+        """
+        if not hasattr(torch, "compile"):
+            return
+
+        try:
+            self.model.model.text_branch = torch.compile(
+                self.model.model.text_branch,
+                mode="reduce-overhead",
+                fullgraph=False,
+                dynamic=True  # バッチサイズ変化での再コンパイルを回避
+            )
+            logger.info("✅ Text encoder compiled (mode=reduce-overhead)")
+        except Exception as e:
+            logger.warning(f"⚠️  torch.compile failed, falling back to eager mode: {e}")
+
+    def _load_onnx_session(self) -> None:
+        """
+        ONNX Runtimeのテキストエンコーダーセッションをロード
+
+        export_onnx.pyでエクスポートしたモデルが存在し、onnxruntimeが
+        インストールされている場合のみ有効化する。演算子融合と最適化
+        済みCPUカーネルにより、eagerなPyTorchよりCPU推論が速い。
+        """
+        onnx_path = os.environ.get("ONNX_TEXT_MODEL_PATH", self.ONNX_MODEL_PATH)
+        if not Path(onnx_path).exists():
+            return
+
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            logger.info("onnxruntime not installed, using PyTorch CPU path")
+            return
+
+        try:
+            sess_options = ort.SessionOptions()
+            sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            self._ort_session = ort.InferenceSession(
+                onnx_path, sess_options, providers=["CPUExecutionProvider"]
+            )
+            logger.info(f"✅ ONNX Runtime text encoder loaded: {onnx_path}")
+        except Exception as e:
+            logger.warning(f"⚠️  Failed to load ONNX model: {e}")
+
+    def _build_token_batch(self, texts: List[str]) -> Dict[str, Any]:
+        """
+        キャッシュ済みトークンを結合してバッチテンソルを構築
+
+        トークナイズ結果は固定長77でパディングされているため、
+        バッチ内最長の実トークン長までスライスしてパディングトークン
+        分の計算を省く。サブバッチがトークン長で揃えられているほど
+        削れる幅が大きい。
+
+        Args:
+            texts: 前処理済みテキストのリスト
+
+        Returns:
+            input_ids / attention_mask のバッチテンソル辞書
+        """
+        batch = {
+            key: torch.cat([self._tokenize_cached(text)[key] for text in texts])
+            for key in ("input_ids", "attention_mask")
+        }
+
+        max_len = int(batch["attention_mask"].sum(-1).max())
+        if 0 < max_len < int(batch["input_ids"].shape[1]):
+            batch = {key: tensor[:, :max_len] for key, tensor in batch.items()}
+        return batch
+
+    def _encode_onnx(self, texts: List[str]) -> np.ndarray:
+        """
+        ONNX Runtimeセッションでエンベディングを計算
+
+        Args:
+            texts: 前処理済みテキストのリスト
+
+        Returns:
+            float32のエンベディング行列 (len(texts), dim)
+        """
+        batch = {key: tensor.numpy() for key, tensor in self._build_token_batch(texts).items()}
+        outputs = self._ort_session.run(None, batch)
+        return outputs[0].astype(np.float32, copy=False)
+
+    def _inference_context(self):
+        """
+        推論用のコンテキストマネージャーを取得
+
+        GPUではFP16のautocastでテンサーコアを活用し、CPUではそのまま
+        FP32で実行する。
+
+        Returns:
+            コンテキストマネージャー
+        """
+        if self.device.type == "cuda":
+            return torch.autocast(device_type="cuda", dtype=torch.float16)
+        return contextlib.nullcontext()
+
+    def _tokenize_cached(self, text: str) -> Dict[str, Any]:
+        """
+        テキストをトークナイズ（結果はLRUキャッシュで再利用）
+
+        Args:
+            text: 前処理済みテキスト
+
+        Returns:
+            input_ids / attention_mask のテンソル辞書
+        """
+        tokens = self._token_cache.get(text)
+        if tokens is None:
+            # laion_clapの標準経路と同一条件でトークナイズ
+            tokens = self.model.tokenize(
+                [text],
+                padding="max_length",
+                truncation=True,
+                max_length=77,
+                return_tensors="pt"
+            )
+            self._token_cache[text] = tokens
+        return tokens
+
+    def _encode_tokenized(self, texts: List[str]) -> "torch.Tensor":
+        """
+        キャッシュ済みトークンIDからエンベディングを直接計算
+
+        laion_clapのget_text_embeddingが毎回行うPythonレベルの
+        トークナイズを、キャッシュ済みテンソルの結合で置き換える。
+        射影とL2正規化は内部モデルのget_text_embeddingが行う。
+
+        Args:
+            texts: 前処理済みテキストのリスト
+
+        Returns:
+            正規化済みエンベディングのテンソル
+        """
+        batch = self._build_token_batch(texts)
+        return self.model.model.get_text_embedding(batch).detach()
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        """
+        テキストのリストをエンベディング行列に変換
+
+        Args:
+            texts: 前処理済みテキストのリスト
+
+        Returns:
+            float32のエンベディング行列 (len(texts), dim)
+        """
+        # CPU環境ではONNX Runtime経路を優先
+        if self._ort_session is not None:
+            try:
+                return self._encode_onnx(texts)
+            except Exception as e:
+                logger.warning(f"⚠️  ONNX inference failed, falling back to PyTorch: {e}")
+                self._ort_session = None
+
+        # 勾配モードはスレッドローカルのため、lifespanでの
+        # set_grad_enabled(False)は推論スレッドプールのスレッドには効かない。
+        # 実行スレッドによらず勾配を確実に無効化するためここでno_gradを張る
+        with torch.no_grad(), self._inference_context():
+            try:
+                text_embeddings = self._encode_tokenized(texts)
+            except Exception as e:
+                # トークナイザー直叩きが使えない環境では標準経路にフォールバック
+                if not self._warned_direct_encode:
+                    logger.warning(f"⚠️  Direct encoder path unavailable, using laion_clap path: {e}")
+                    self._warned_direct_encode = True
+                text_embeddings = self.model.get_text_embedding(texts)
+
+        return self._to_numpy(text_embeddings)
+
+    def _to_numpy(self, text_embeddings: "torch.Tensor") -> np.ndarray:
+        """
+        エンベディングテンソルをfloat32のNumPy配列に変換
+
+        GPUではピン止めバッファへ専用ストリームで非同期D2Hコピーを行い、
+        デフォルトストリーム上の次バッチの計算をブロックしない。
+
+        Args:
+            text_embeddings: エンベディングのテンソル (n, dim)
+
+        Returns:
+            float32のNumPy配列 (n, dim)
+        """
+        if (
+            self._copy_stream is not None
+            and text_embeddings.is_cuda
+            and len(text_embeddings) <= self.MAX_PINNED_BATCH
+        ):
+            n = len(text_embeddings)
+            # コピー元を生成した計算ストリームの完了を待ってからD2Hコピーを
+            # 発行する（待たないと計算完了前のバッファを読むデータレースになる）
+            self._copy_stream.wait_stream(torch.cuda.current_stream())
+            with torch.cuda.stream(self._copy_stream):
+                self._pinned[:n].copy_(text_embeddings.float(), non_blocking=True)
+            self._copy_stream.synchronize()
+            # ピン止めバッファは次のバッチで上書きされるためコピーを返す
+            return self._pinned[:n].numpy().copy()
+
+        # CPU（またはピン止めバッファに収まらないバッチ）は同期コピー
+        return text_embeddings.cpu().numpy().astype(np.float32, copy=False)
+
     def preprocess_text(self, text: str) -> str:
         """
         テキストの前処理
-        
+
+        API経由の入力はPydanticバリデーターで検証済みのため、
+        ライブラリとして直接使う場合の前処理として残している。
+
         Args:
             text: 入力テキスト
             
@@ -87,20 +478,21 @@ class VectorProcessor:
             self.initialize_model()
         
         try:
-            # テキスト前処理
-            processed_text = self.preprocess_text(keyword)
+            # 前処理（strip・空文字チェック）はAPI層のPydanticバリデーターが行う
+            processed_text = keyword
             logger.info(f"Vectorizing keyword: {processed_text}")
-            
-            # テキストエンベディングを取得
-            with torch.no_grad():
-                text_embeddings = self.model.get_text_embedding([processed_text])
-                
-            # NumPy配列に変換
-            vector = text_embeddings.cpu().numpy().flatten()
-            
+
+            # キャッシュヒット時はエンコーダーをスキップ
+            cache_key = self._cache_key(processed_text)
+            vector = self._cache_get(cache_key)
+            if vector is None:
+                # テキストエンベディングを取得してキャッシュ
+                vector = self._encode_batch([processed_text])[0]
+                self._cache_put(cache_key, vector)
+
             result = {
                 "keyword": processed_text,
-                "vector": vector.tolist(),
+                "vector": vector,
                 "dimension": len(vector),
                 "model_info": {
                     "model_name": self.model_name,
@@ -133,32 +525,59 @@ class VectorProcessor:
             return []
         
         try:
-            # 前処理
-            processed_texts = [self.preprocess_text(keyword) for keyword in keywords]
+            # 前処理（strip・空文字チェック）はAPI層のPydanticバリデーターが行う
+            processed_texts = keywords
             logger.info(f"Batch vectorizing {len(processed_texts)} keywords")
-            
-            # バッチでテキストエンベディングを取得
-            with torch.no_grad():
-                text_embeddings = self.model.get_text_embedding(processed_texts)
-                
-            # NumPy配列に変換
-            vectors = text_embeddings.cpu().numpy()
-            
-            results = []
-            for i, (keyword, processed_text) in enumerate(zip(keywords, processed_texts)):
-                vector = vectors[i].flatten()
-                result = {
+
+            # キャッシュヒット・ミスに分割（順序はインデックスで保持）
+            # 同一テキストの重複は1回だけエンコードし、結果をファンアウトする
+            row_vectors: List[Optional[np.ndarray]] = []
+            miss_texts: List[str] = []
+            miss_rows: Dict[str, List[int]] = {}
+            for i, processed_text in enumerate(processed_texts):
+                vector = self._cache_get(self._cache_key(processed_text))
+                row_vectors.append(vector)
+                if vector is None:
+                    if processed_text not in miss_rows:
+                        miss_rows[processed_text] = []
+                        miss_texts.append(processed_text)
+                    miss_rows[processed_text].append(i)
+
+            if miss_texts:
+                # トークン長の近いサブバッチに分けてパディング由来の無駄を削減
+                for group in self._split_by_length(miss_texts):
+                    group_texts = [miss_texts[i] for i in group]
+
+                    # サブバッチのサイズをバケットに揃えてセンチネルでパディング
+                    bucket = self._bucket_size(len(group_texts))
+                    padded_texts = group_texts + [self.PAD_TEXT] * (bucket - len(group_texts))
+
+                    # サブバッチのエンベディングを取得（パディング行は除外）
+                    vectors = self._encode_batch(padded_texts)[:len(group_texts)]
+                    for row, group_text in enumerate(group_texts):
+                        # 2次元配列の行インデックスは既に1次元（flattenは不要）
+                        vector = vectors[row]
+                        self._cache_put(self._cache_key(group_text), vector)
+                        # 重複していた行すべてに同じベクトルをファンアウト
+                        for row_index in miss_rows[group_text]:
+                            row_vectors[row_index] = vector
+
+            # モデル情報は全結果で共通（辞書を1回だけ構築）
+            model_info = {
+                "model_name": self.model_name,
+                "enable_fusion": self.enable_fusion,
+                "device": str(self.device)
+            }
+            results = [
+                {
                     "keyword": processed_text,
-                    "vector": vector.tolist(),
+                    "vector": vector,
                     "dimension": len(vector),
-                    "model_info": {
-                        "model_name": self.model_name,
-                        "enable_fusion": self.enable_fusion,
-                        "device": str(self.device)
-                    }
+                    "model_info": model_info
                 }
-                results.append(result)
-            
+                for processed_text, vector in zip(processed_texts, row_vectors)
+            ]
+
             logger.info(f"Successfully vectorized {len(results)} keywords")
             return results
             
@@ -179,20 +598,3 @@ class VectorProcessor:
             "device": str(self.device),
             "initialized": self.model is not None
         }
-
-
-# グローバルインスタンス（シングルトンパターン）
-_vector_processor: Optional[VectorProcessor] = None
-
-
-def get_vector_processor() -> VectorProcessor:
-    """
-    VectorProcessorのシングルトンインスタンスを取得
-    
-    Returns:
-        VectorProcessorインスタンス
-    """
-    global _vector_processor
-    if _vector_processor is None:
-        _vector_processor = VectorProcessor()
-    return _vector_processor
\ No newline at end of file
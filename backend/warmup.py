@@ -7,7 +7,10 @@ CLAPモデルを事前にロードしてコールドスタート問題を軽減
 import asyncio
 import logging
 import time
-from vector_processor import get_vector_processor
+
+import torch
+
+from vector_processor import VectorProcessor
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -18,13 +21,26 @@ async def warmup_model():
     try:
         logger.info("🔥 Starting model warmup...")
         start_time = time.time()
-        
-        # VectorProcessorを取得・初期化
-        processor = get_vector_processor()
+
+        # 推論専用のため勾配を無効化（単一スレッド実行のためこれで十分）
+        torch.set_grad_enabled(False)
+
+        # VectorProcessorを作成・初期化
+        processor = VectorProcessor()
         
         # テストベクトル化でモデルをウォームアップ
         test_result = processor.vectorize_keyword("test warmup")
-        
+
+        # サーバーが使う各バケットサイズのコンパイル済みグラフを事前キャプチャ
+        # （キャッシュヒットでエンコーダーがスキップされないよう全て別テキスト）
+        # バッチAPIはmax_items=100を許容し65件以上は128にパディングされるため
+        # 128までウォームアップする
+        for batch_size in (1, 2, 4, 8, 16, 32, 64, 128):
+            keywords = [f"warmup {batch_size}-{i}" for i in range(batch_size)]
+            bucket_start = time.time()
+            processor.vectorize_batch(keywords)
+            logger.info(f"   Bucket {batch_size} warmed in {time.time() - bucket_start:.2f}s")
+
         warmup_time = time.time() - start_time
         logger.info(f"✅ Model warmup completed in {warmup_time:.2f}s")
         logger.info(f"   Test vector dimension: {test_result['dimension']}")